@@ -1,10 +1,12 @@
 #!/usr/bin/env python
 """Formatting-related tests."""
+import argparse
 import io
 import os
 import pathlib
 import sys
 import unittest
+import unittest.mock
 
 # Sets up sys.path and provides helpers
 import testutils as tu
@@ -62,6 +64,48 @@ class TestFormatting(unittest.TestCase):
         self.assertEqual(self._format(b"data[1 :1-1];").rstrip(), b"data[1 : 1 - 1];")
         self.assertEqual(self._format(b"data[f(): ];").rstrip(), b"data[f() :];")
 
+    def test_deep_nesting(self):
+        # Parsing doesn't recurse, so nesting depth isn't bounded by Python's
+        # recursion limit. A long chain of additions nests one level per term.
+        terms = [b"a%d" % i for i in range(3000)]
+        script = zeekscript.Script(io.BytesIO(b"global x = " + b"+".join(terms) + b";"))
+        self.assertTrue(script.parse())
+        self.assertFalse(script.has_error())
+
+        # Formatting recurses at a few stack frames per nesting level, so it
+        # handles a couple hundred levels at the default recursion limit.
+        terms = terms[:200]
+        result = self._format(b"global x = " + b"+".join(terms) + b";")
+        self.assertEqual(result.count(b"+"), len(terms) - 1)
+
+    def test_deep_nesting_cli(self):
+        # The command line raises the recursion limit while formatting, so it
+        # handles much deeper nesting than the default limit allows.
+        terms = [b"a%d" % i for i in range(1500)]
+        tmpfile = "tmp.zeek"
+        limit = sys.getrecursionlimit()
+
+        parser = argparse.ArgumentParser()
+        zeekscript.add_format_cmd(parser)
+        args = parser.parse_args(["-i", tmpfile])
+
+        try:
+            with open(tmpfile, "wb") as hdl:
+                hdl.write(b"global x = " + b"+".join(terms) + b";")
+
+            with unittest.mock.patch(
+                "sys.stdout", new=io.StringIO()
+            ), unittest.mock.patch("sys.stderr", new=io.StringIO()) as err:
+                self.assertEqual(args.run_cmd(args), 0)
+                self.assertEqual(err.getvalue(), "")
+
+            with open(tmpfile, "rb") as hdl:
+                self.assertEqual(hdl.read().count(b"+"), len(terms) - 1)
+        finally:
+            os.unlink(tmpfile)
+
+        self.assertEqual(sys.getrecursionlimit(), limit)
+
 
 class TestFormattingErrors(unittest.TestCase):
     def _format(self, content):
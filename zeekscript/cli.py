@@ -14,6 +14,11 @@ FILE_HELP = (
     "filenames entirely implies reading from stdin."
 )
 
+# Formatting recurses through the parse tree at a few stack frames per nesting
+# level. While formatting, the command line raises Python's recursion limit to
+# this, enough for e.g. string concatenation chains of 2000 terms.
+FORMAT_RECURSION_LIMIT = 10000
+
 
 def cmd_format(args):
     """This function implements Zeek script formatting for the command line.
@@ -95,6 +100,8 @@ def cmd_format(args):
             return 1
 
         buf = io.BytesIO()
+        limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(max(limit, FORMAT_RECURSION_LIMIT))
 
         try:
             script.format(buf, not args.no_linebreaks)
@@ -104,6 +111,8 @@ def cmd_format(args):
             traceback.print_exc(file=sys.stderr)
             do_write(script.source)
             return 1
+        finally:
+            sys.setrecursionlimit(limit)
 
         # Write out the complete, reformatted source.
         do_write(buf.getvalue())
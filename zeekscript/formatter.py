@@ -14,10 +14,14 @@ comments). The CST features such elements, whereas the AST does not. You can
 examine the difference by playing with `zeek-script parse ...` vs `zeek-script
 parse --concrete`.
 """
-import enum
-import inspect
 import os
-import sys
+import re
+
+# Our newline bytestring, plus runs of newlines and spaces we write frequently,
+# so we don't need to build these anew for every write.
+_NL = os.linesep.encode("UTF-8")
+_NLS = (b"", _NL, _NL * 2)
+_SPACES = tuple(b" " * num for num in range(17))
 
 
 class NodeMapper:
@@ -30,41 +34,36 @@ class NodeMapper:
         """Map a given symbol name to a given formatter class."""
         self._map[symbol_name] = klass
 
-    def get(self, symbol_name):
-        """Returns a Formatter class for a given symbol name.
-
-        If an explicit mapping was established earlier, this returns its
-        result. Otherwise, it tries to map the symbol name to a corresponding
-        class name ("module_decl" -> "ModuleDeclFormatter"). When this fails as
-        well, it falls back to returning the Formatter class.
-        """
-        if symbol_name in self._map:
-            return self._map[symbol_name]
-
-        self._find_class(symbol_name)
+    def register_all(self, mapping):
+        """Map the symbol names in the given dict to their formatter classes."""
+        self._map.update(mapping)
 
-        if symbol_name in self._map:
-            return self._map[symbol_name]
+    def register_classes(self, namespace):
+        """Map symbol names to the *Formatter classes in the given namespace.
 
-        return Formatter
-
-    def _find_class(self, symbol_name):
-        """Establishes symbol type -> Formatter class mapping.
-
-        For example, this will try to resolve symbol type "module_decl" as
-        ModuleDeclFormatter. When such a class exists, this adds a mapping to
-        the internal _map so we don't have to resolve next time.
+        This derives the symbol name from every such class name, e.g.
+        "ModuleDeclFormatter" -> "module_decl". Explicit registrations made
+        earlier take precedence.
         """
-        name_parts = [part.title() for part in symbol_name.split("_")]
-        derived = "".join(name_parts) + "Formatter"
+        for name, obj in namespace.items():
+            if (
+                not isinstance(obj, type)
+                or not issubclass(obj, Formatter)
+                or not name.endswith("Formatter")
+                or name == "Formatter"
+            ):
+                continue
 
-        def pred(mem):
-            return inspect.isclass(mem) and mem.__name__ == derived
+            symbol_name = re.sub(r"(?<!^)(?=[A-Z])", "_", name[:-9]).lower()
+            self._map.setdefault(symbol_name, obj)
 
-        classes = inspect.getmembers(sys.modules[__name__], pred)
+    def get(self, symbol_name):
+        """Returns a Formatter class for a given symbol name.
 
-        if classes:
-            self._map[symbol_name] = classes[0][1]
+        This returns the class registered for the symbol, or falls back to the
+        Formatter class when there is none.
+        """
+        return self._map.get(symbol_name, Formatter)
 
 
 MAP = NodeMapper()
@@ -73,25 +72,38 @@ MAP = NodeMapper()
 # ---- Symbol formatters -------------------------------------------------------
 
 
-class Hint(enum.Flag):
+# pylint: disable-next=too-few-public-methods
+class Hint:
     """Linebreak hinting when we write out otherwise formatted lines.
 
     The formatters provide these hints based on their surrounding context.  On
     occasion, hinting is also used to pass flags from higher-level (in the tree)
     to lower-level Formatters.
+
+    The hints are plain integer bit flags, since formatters combine and test
+    them for pretty much every node: use "|" to combine and "&" to test them.
     """
 
-    NONE = enum.auto()
-    GOOD_AFTER_LB = enum.auto()  # A linebreak before this item is encouraged.
-    NO_LB_BEFORE = enum.auto()  # Never line-break before this item.
-    NO_LB_AFTER = enum.auto()  # Never line-break after this item.
-    ZERO_WIDTH = enum.auto()  # This item doesn't contribute to line length.
-    COMPLEX_BLOCK = enum.auto()  # A {}-block is complex enough to linebreak
+    NONE = 0
+    GOOD_AFTER_LB = 1 << 0  # A linebreak before this item is encouraged.
+    NO_LB_BEFORE = 1 << 1  # Never line-break before this item.
+    NO_LB_AFTER = 1 << 2  # Never line-break after this item.
+    ZERO_WIDTH = 1 << 3  # This item doesn't contribute to line length.
+    COMPLEX_BLOCK = 1 << 4  # A {}-block is complex enough to linebreak
 
 
 class Formatter:
+    # There are lots of formatters (one per node), so keep them lean. Derived
+    # classes define __slots__ as well, to preserve this.
+    __slots__ = ("script", "node", "ostream", "indent", "hints", "_cidx")
+
     # Our newline bytestring
-    NL = os.linesep.encode("UTF-8")
+    NL = _NL
+
+    # Layout parameters for the default formatting in format(): an optional
+    # separator between children, and whether to end with a newline.
+    SEPARATOR = None
+    TRAILING_NL = False
 
     def __init__(self, script, node, ostream, indent=0, hints=None):
         """Formatter constructor.
@@ -119,23 +131,28 @@ class Formatter:
         """Default formatting for a tree node
 
         This simply writes out children as per their own formatting, and writes
-        out tokens directly.
+        out tokens directly. Derived classes can adjust the SEPARATOR and
+        TRAILING_NL class members to tweak the layout.
         """
         if self.node.children:
-            self._format_children()
+            self._format_children(self.SEPARATOR)
+            if self.TRAILING_NL:
+                self._write_nl()
         else:
             self._format_token()
 
     def _next_child(self):
-        try:
-            node = self.node.nonerr_children[self._cidx]
-            self._cidx += 1
-            return node
-        except IndexError:
+        children, cidx = self.node.nonerr_children, self._cidx
+
+        if cidx >= len(children):
             return None
 
+        self._cidx = cidx + 1
+        return children[cidx]
+
     def _format_child_impl(self, node, indent, hints=None):
-        fclass = Formatter.lookup(node)
+        # This is Formatter.lookup(), inlined since it runs for every node.
+        fclass = MAP.get(node.type) if node.is_named else Formatter
         formatter = fclass(
             self.script,
             node,
@@ -152,25 +169,43 @@ class Formatter:
         # XXX Pretty subtle that we handle the child's surrounding context here,
         # in the parent. Might have to refactor in the future.
 
+        # Most nodes have no error or CST nodes around them, so we check the
+        # lists for content before setting up any iteration.
+
         # If the node has any preceding errors, render these out first.  Do
         # this via _format_child(), not _format_child_impl(), since the error
         # nodes are full-blown AST nodes potentially with their own CST
         # neighborhood.
-        for node in child.prev_error_siblings:
-            self._format_child(node, indent)
-
-        for node in child.prev_cst_siblings:
-            self._format_child_impl(node, indent)
-
-        # The hints apply to AST (not CST) nodes, so now:
-        self._format_child_impl(child, indent, hints)
+        if child.prev_error_siblings:
+            for node in child.prev_error_siblings:
+                self._format_child(node, indent)
+
+        if child.prev_cst_siblings:
+            for node in child.prev_cst_siblings:
+                self._format_child_impl(node, indent)
+
+        # The hints apply to AST (not CST) nodes, so now. This is
+        # _format_child_impl() inlined, since saving a stack frame for every
+        # level of the tree helps with deeply nested scripts.
+        fclass = MAP.get(child.type) if child.is_named else Formatter
+        formatter = fclass(
+            self.script, child, self.ostream, self.indent + int(indent), hints
+        )
+        if fclass is Formatter and not child.children:
+            # A plain token, the most common kind of node. Write it out
+            # directly, bypassing format()'s dispatch.
+            formatter._format_token()  # pylint: disable=protected-access
+        else:
+            formatter.format()
 
-        for node in child.next_cst_siblings:
-            self._format_child_impl(node, indent)
+        if child.next_cst_siblings:
+            for node in child.next_cst_siblings:
+                self._format_child_impl(node, indent)
 
         # Mirroring the above, handle any trailing errors last.
-        for node in child.next_error_siblings:
-            self._format_child(node, indent)
+        if child.next_error_siblings:
+            for node in child.next_error_siblings:
+                self._format_child(node, indent)
 
     def _format_child_range(self, num, hints=None, first_hints=None):
         """Format a given number of children of the node.
@@ -188,24 +223,50 @@ class Formatter:
         if num <= 0:
             return
 
+        # We know exactly which children we're formatting, so hand them to
+        # _format_child() directly instead of having it fetch each one.
+        children = self.node.nonerr_children
+        first = self._cidx
+        last = first + num - 1
+        self._cidx = last + 1
+
         if num == 1:
             # Single element: general and first-element hinting
-            self._format_child(hints=hints | first_hints)
+            self._format_child(children[first], hints=hints | first_hints)
             return
 
         # First element of multiple: general hinting; first-element hinting;
         # avoid line breaks after the element.
-        # pylint: disable=unsupported-binary-operation
-        self._format_child(hints=hints | first_hints | Hint.NO_LB_AFTER)
+        self._format_child(
+            children[first], hints=hints | first_hints | Hint.NO_LB_AFTER
+        )
 
         # Inner elements: general hinting; avoid line breaks
-        for _ in range(num - 2):
-            # pylint: disable=unsupported-binary-operation
-            self._format_child(hints=hints | Hint.NO_LB_AFTER)
+        inner_hints = hints | Hint.NO_LB_AFTER
+        for cidx in range(first + 1, last):
+            self._format_child(children[cidx], hints=inner_hints)
 
         # Last element: general hinting; avoid line break before
-        # pylint: disable=unsupported-binary-operation
-        self._format_child(hints=hints | Hint.NO_LB_BEFORE)
+        self._format_child(children[last], hints=hints | Hint.NO_LB_BEFORE)
+
+    def _format_child_spaced(self, hints=None):
+        """Format the next child with a single space on either side."""
+        self._write(b" ")
+        self._format_child(hints=hints)
+        self._write(b" ")
+
+    def _format_comma_sp(self):
+        """Format the next child and a space after it, if it is a ','.
+
+        Returns True if it was a comma, False otherwise.
+        """
+        comma = self._get_child()
+        if comma is None or comma.type != ",":
+            return False
+
+        self._format_child(hints=Hint.NO_LB_BEFORE)
+        self._write_sp()
+        return True
 
     def _format_children(self, sep=None):
         """Format all children of the node.
@@ -215,16 +276,31 @@ class Formatter:
         the first child, so the hint does not get lost on the path down the
         tree.
         """
-        if self._children_remaining():
-            self._format_child(hints=self.hints)
+        children = self.node.nonerr_children
+        first, self._cidx = self._cidx, len(children)
+
+        if first >= len(children):
+            return
 
-        while self._children_remaining():
+        self._format_child(children[first], hints=self.hints)
+
+        for cidx in range(first + 1, len(children)):
             if sep is not None:
                 self._write(sep)
-            self._format_child()
+            self._format_child(children[cidx])
 
     def _format_token(self):
-        self._write(self.script.get_content(*self.node.script_range()))
+        # This is _write(script.get_content(*node.script_range())), inlined
+        # since it runs for every token. Newlines are nodes of their own, so
+        # token content never starts with one.
+        node = self.node
+        data = self.script.source[node.start_byte : node.end_byte]
+
+        if self.ostream.at_bol:
+            self.ostream.write_indent(self)
+            data = data.lstrip()
+
+        self.ostream.write(data, self)
 
     def _format_curly_statement_list(self, indent=True):
         """Format a child sequence of '{' <stmt_list>? '}'
@@ -252,12 +328,14 @@ class Formatter:
         self._format_child(indent=indent)  # '}'
 
     def _write(self, data, raw=False):
-        if isinstance(data, str):
-            data = data.encode("UTF-8")
+        """Writes the given bytes to the output stream, indenting as needed.
 
+        All of our formatting works on bytes (the script's content is bytes, as
+        are our separators and whitespace), so data needs to be bytes, too.
+        """
         # Transparently indent at the beginning of lines, but only if we're not
         # writing a newline anyway.
-        if not data.startswith(self.NL) and self._write_indent():
+        if not data.startswith(_NL) and self._write_indent():
             # We just indented. Don't write any additional whitespace at the
             # beginning now. Such whitespace might exist from spacing that
             # would result without the presence of interrupting comments.
@@ -266,33 +344,33 @@ class Formatter:
         self.ostream.write(data, self, raw)
 
     def _write_indent(self):
-        if self.ostream.get_column() == 0:
-            self.ostream.write_tab_indent(self)
-            self.ostream.write_space_align(self)
+        if self.ostream.at_bol:
+            self.ostream.write_indent(self)
             return True
         return False
 
     def _write_sp(self, num=1):
-        self._write(b" " * num)
+        self._write(_SPACES[num] if 0 <= num < len(_SPACES) else b" " * num)
 
     def _write_nl(self, num=1, force=False, is_midline=False):
         # It's rare that we really want to write newlines multiple times in
         # a row. If we just wrote one, don't do so again unless forced.
         # Still adjust space-alignment mode for the next write, though.
-        if self.ostream.get_column() == 0 and not force:
-            self.ostream.use_space_align(is_midline)
+        if self.ostream.at_bol and not force:
+            self.ostream.space_align = is_midline
             return
 
-        self._write(self.NL * num)
+        # Newlines never need indentation, so skip _write()'s check for it.
+        self.ostream.write(_NLS[num] if num < len(_NLS) else _NL * num, self)
 
         # It's key here that space alignment mode is set after we write,
         # otherwise we cannot cancel its effect upon a second NL because
         # indentation/alignment will have already happened.
-        self.ostream.use_space_align(is_midline)
+        self.ostream.space_align = is_midline
 
     def _children_remaining(self):
         """Returns number of children of this node not yet visited."""
-        return len(self.node.nonerr_children[self._cidx :])
+        return len(self.node.nonerr_children) - self._cidx
 
     def _get_child(self, offset=0, absolute=False):
         """Accessor for child nodes, without adjusting the offset index.
@@ -305,14 +383,10 @@ class Formatter:
 
         When the resulting index isn't valid, returns None.
         """
-        cidx = 0 if absolute else self._cidx
+        children = self.node.nonerr_children
+        cidx = (0 if absolute else self._cidx) + offset
 
-        try:
-            return self.node.nonerr_children[cidx + offset]
-        except IndexError:
-            return None
-
-        return None
+        return children[cidx] if 0 <= cidx < len(children) else None
 
     def _get_child_type(self, offset=0, absolute=False):
         """Like _get_child(), but returns the TS type string ("decl", "stmt", etc).
@@ -323,20 +397,16 @@ class Formatter:
 
         Returns None when no matching node exists.
         """
-        try:
-            return self._get_child(offset, absolute).type
-        except AttributeError:
-            return None
+        child = self._get_child(offset, absolute)
+        return None if child is None else child.type
 
     def _get_child_name(self, offset=0, absolute=False):
         """Like _get_child_type(), but for named nodes.
 
         Returns None of the child isn't a named node or no matching node exists.
         """
-        try:
-            return self._get_child(offset, absolute).name()
-        except AttributeError:
-            return None
+        child = self._get_child(offset, absolute)
+        return child.type if child is not None and child.is_named else None
 
     def _get_child_token(self, offset=0, absolute=False):
         """Like _get_child_type(), but for terminal nodes.
@@ -344,10 +414,22 @@ class Formatter:
         Returns None of the child doesn't represent a plain token or no matching
         node exists.
         """
-        try:
-            return self._get_child(offset, absolute).token()
-        except AttributeError:
-            return None
+        child = self._get_child(offset, absolute)
+        return child.type if child is not None and not child.is_named else None
+
+    def _peek(self, offset=0):
+        """Combines _get_child_name() and _get_child_token() into one lookup.
+
+        Returns a (name, token) tuple for the child at the given offset. At
+        most one of the two is set, and both are None when no matching node
+        exists.
+        """
+        child = self._get_child(offset)
+        if child is None:
+            return None, None
+        if child.is_named:
+            return child.type, None
+        return None, child.type
 
     @staticmethod
     def register(symbol_name, klass):
@@ -367,6 +449,8 @@ class Formatter:
 class NullFormatter(Formatter):
     """The null formatter doesn't output anything."""
 
+    __slots__ = ()
+
     def format(self):
         pass
 
@@ -393,6 +477,8 @@ class ErrorFormatter(Formatter):
     an optional space that gets ignored when neighbored by other whitespace.
     """
 
+    __slots__ = ()
+
     def format(self):
         if not self.node.children:
             content = self.script.get_content(*self.node.script_range())
@@ -432,27 +518,25 @@ class ErrorFormatter(Formatter):
 class LineFormatter(Formatter):
     """This formatter separates all nodes with space and terminates with a newline."""
 
-    def format(self):
-        if self.node.children:
-            self._format_children(b" ")
-            self._write_nl()
-        else:
-            self._format_token()
+    __slots__ = ()
+
+    SEPARATOR = b" "
+    TRAILING_NL = True
 
 
 class SpaceSeparatedFormatter(Formatter):
     """This formatter simply separates all nodes with a space."""
 
-    def format(self):
-        if self.node.children:
-            self._format_children(b" ")
-        else:
-            self._format_token()
+    __slots__ = ()
+
+    SEPARATOR = b" "
 
 
 class PreprocDirectiveFormatter(LineFormatter):
     """@if and friends don't get indented or line-broken."""
 
+    __slots__ = ()
+
     def format(self):
         self.ostream.use_tab_indent(False)
         self.ostream.use_linebreaks(False)
@@ -462,6 +546,8 @@ class PreprocDirectiveFormatter(LineFormatter):
 
 
 class ModuleDeclFormatter(Formatter):
+    __slots__ = ()
+
     def format(self):
         self._format_child()  # 'module'
         self._write_sp()
@@ -470,6 +556,8 @@ class ModuleDeclFormatter(Formatter):
 
 
 class ExportDeclFormatter(Formatter):
+    __slots__ = ()
+
     def format(self):
         # No Whitesmith here: "{" on same line, closing "}" unindented.
         self._format_child()  # 'export'
@@ -487,6 +575,8 @@ class TypedInitializerFormatter(Formatter):
     [:<type>] [<initializer] [attributes]
     """
 
+    __slots__ = ()
+
     def _format_typed_initializer(self):
         if self._get_child_token() == ":":
             self._format_child(hints=Hint.NO_LB_AFTER)  # ':'
@@ -507,6 +597,8 @@ class GlobalDeclFormatter(TypedInitializerFormatter):
     value redefs), which all layout similarly.
     """
 
+    __slots__ = ()
+
     def format(self):
         self._format_child()  # "global", "option", etc
         self._write_sp()
@@ -526,6 +618,8 @@ class ComplexSequenceFormatterMixin:
     The default complexity decision looks for comments in the subtree.
     """
 
+    __slots__ = ()
+
     def is_complex(self):
         return self.is_complex_node(self.node)
 
@@ -548,6 +642,8 @@ class ComplexSequenceFormatterMixin:
 
 
 class InitializerFormatter(Formatter):
+    __slots__ = ()
+
     def format(self):
         # This is just space-separation, really. I'm leaving the class in place
         # for now since I think initializer handling isn't fully settled.
@@ -559,6 +655,8 @@ class InitializerFormatter(Formatter):
 class EnumBodyFormatterMixin(ComplexSequenceFormatterMixin):
     """A mixin that knows when to break an enum_body onto lines."""
 
+    __slots__ = ()
+
     def _format_curly_enum_body(self):
         """Formats an '{' <enum_body> '}' sequence."""
         do_linebreak = self.is_complex()  # Must call before we consume '{'
@@ -578,6 +676,8 @@ class EnumBodyFormatterMixin(ComplexSequenceFormatterMixin):
 
 
 class RedefEnumDeclFormatter(Formatter, EnumBodyFormatterMixin):
+    __slots__ = ()
+
     def format(self):
         self._format_child()  # 'redef'
         self._write_sp()
@@ -593,6 +693,8 @@ class RedefEnumDeclFormatter(Formatter, EnumBodyFormatterMixin):
 
 
 class RedefRecordDeclFormatter(Formatter):
+    __slots__ = ()
+
     def format(self):
         self._format_child()  # 'redef'
         self._write_sp()
@@ -615,6 +717,8 @@ class RedefRecordDeclFormatter(Formatter):
 
 
 class TypeDeclFormatter(Formatter):
+    __slots__ = ()
+
     def format(self):
         self._format_child()  # 'type'
         self._write_sp()
@@ -629,50 +733,67 @@ class TypeDeclFormatter(Formatter):
 
 
 class TypeFormatter(SpaceSeparatedFormatter, EnumBodyFormatterMixin):
-    def format(self):
-        if self._get_child_token() == "set":
-            self._format_child()  # 'set'
-            self._format_typelist()  # '[' ... ']'
+    __slots__ = ()
 
-        elif self._get_child_token() == "table":
-            self._format_child()  # 'table'
-            self._format_typelist()  # '[' ... ']'
-            self._write_sp()
-            self._format_child()  # 'of'
-            self._write_sp()
-            self._format_child()  # <type>
+    def _format_set(self):
+        self._format_child()  # 'set'
+        self._format_typelist()  # '[' ... ']'
 
-        elif self._get_child_token() == "record":
-            # No Whitesmith here: "{" on same line, closing "}" unindented.
-            self._format_child()  # 'record',
-            self._write_sp()
-            self._format_child()  # '{'
+    def _format_table(self):
+        self._format_child()  # 'table'
+        self._format_typelist()  # '[' ... ']'
+        self._write_sp()
+        self._format_child()  # 'of'
+        self._write_sp()
+        self._format_child()  # <type>
 
-            if self._get_child_name() == "type_spec":  # any number of type_specs
-                self._write_nl()
-                while self._get_child_name() == "type_spec":
-                    self._format_child(indent=True)
-            else:
-                self._write_sp()  # empty record, keep on one line
+    def _format_record(self):
+        # No Whitesmith here: "{" on same line, closing "}" unindented.
+        self._format_child()  # 'record',
+        self._write_sp()
+        self._format_child()  # '{'
 
-            self._format_child()  # '}'
+        if self._get_child_name() == "type_spec":  # any number of type_specs
+            self._write_nl()
+            while self._get_child_name() == "type_spec":
+                self._format_child(indent=True)
+        else:
+            self._write_sp()  # empty record, keep on one line
 
-        elif self._get_child_token() == "enum":
-            # No Whitesmith here: "{" on same line, closing "}" unindented.
-            self._format_child()  # 'enum'
-            self._write_sp()
-            self._format_curly_enum_body()
+        self._format_child()  # '}'
 
-        elif self._get_child_token() == "function":
-            self._format_child_range(2)  # 'function' <func_params>
+    def _format_enum(self):
+        # No Whitesmith here: "{" on same line, closing "}" unindented.
+        self._format_child()  # 'enum'
+        self._write_sp()
+        self._format_curly_enum_body()
+
+    def _format_function(self):
+        self._format_child_range(2)  # 'function' <func_params>
+
+    def _format_event_hook(self):
+        self._format_child()  # 'event'/'hook'
+        self._format_child(hints=Hint.NO_LB_BEFORE)  # '('
+        if self._get_child_name() == "formal_args":
+            self._format_child()
+        self._format_child(hints=Hint.NO_LB_BEFORE)  # ')'
 
-        elif self._get_child_token() in ["event", "hook"]:
-            self._format_child()  # 'event'/'hook'
-            self._format_child(hints=Hint.NO_LB_BEFORE)  # '('
-            if self._get_child_name() == "formal_args":
-                self._format_child()
-            self._format_child(hints=Hint.NO_LB_BEFORE)  # ')'
+    # Handlers for types identified by their first token.
+    _TOKEN_HANDLERS = {
+        "set": _format_set,
+        "table": _format_table,
+        "record": _format_record,
+        "enum": _format_enum,
+        "function": _format_function,
+        "event": _format_event_hook,
+        "hook": _format_event_hook,
+    }
+
+    def format(self):
+        handler = self._TOKEN_HANDLERS.get(self._get_child_token())
 
+        if handler is not None:
+            handler(self)
         else:
             # Format anything else with plain space separation, e.g. "vector of foo"
             super().format()
@@ -681,13 +802,13 @@ class TypeFormatter(SpaceSeparatedFormatter, EnumBodyFormatterMixin):
         self._format_child(hints=Hint.NO_LB_BEFORE)  # '['
         while self._get_child_name() == "type":
             self._format_child()  # <type>
-            if self._get_child_token() == ",":
-                self._format_child(hints=Hint.NO_LB_BEFORE)  # ','
-                self._write_sp()
+            self._format_comma_sp()
         self._format_child(hints=Hint.NO_LB_BEFORE)  # ']'
 
 
 class TypeSpecFormatter(Formatter):
+    __slots__ = ()
+
     def format(self):
         self._format_child(hints=Hint.NO_LB_AFTER)  # <id>
         self._format_child(hints=Hint.NO_LB_AFTER)  # ':'
@@ -701,8 +822,10 @@ class TypeSpecFormatter(Formatter):
 
 
 class EnumBodyFormatter(Formatter):
+    __slots__ = ()
+
     def format(self):
-        if Hint.COMPLEX_BLOCK in self.hints:
+        if self.hints & Hint.COMPLEX_BLOCK:
             # Treat this as a "complex": break every value onto a new line.
             while self._get_child():
                 self._format_child()  # enum_body_elem
@@ -722,6 +845,8 @@ class EnumBodyFormatter(Formatter):
 
 
 class FuncDeclFormatter(Formatter):
+    __slots__ = ()
+
     def format(self):
         self._format_child()  # <func_hdr>
         if self._get_child_name() == "preproc_directive":
@@ -736,11 +861,15 @@ class FuncDeclFormatter(Formatter):
 
 
 class FuncHdrFormatter(Formatter):
+    __slots__ = ()
+
     def format(self):
         self._format_child()  # <func>, <hook>, or <event>
 
 
 class FuncHdrVariantFormatter(Formatter):
+    __slots__ = ()
+
     def format(self):
         if self._get_child_token() == "redef":
             self._format_child()  # 'redef'
@@ -755,6 +884,8 @@ class FuncHdrVariantFormatter(Formatter):
 
 
 class FuncParamsFormatter(Formatter):
+    __slots__ = ()
+
     def format(self):
         self._format_child(hints=Hint.NO_LB_BEFORE)  # '('
         if self._get_child_name() == "formal_args":
@@ -767,12 +898,16 @@ class FuncParamsFormatter(Formatter):
 
 
 class FuncBodyFormatter(Formatter):
+    __slots__ = ()
+
     def format(self):
         self._write_nl()
         self._format_curly_statement_list()
 
 
 class FormalArgsFormatter(Formatter):
+    __slots__ = ()
+
     def format(self):
         while self._get_child_name() == "formal_arg":
             self._format_child()  # <formal_arg>
@@ -782,6 +917,8 @@ class FormalArgsFormatter(Formatter):
 
 
 class FormalArgFormatter(Formatter):
+    __slots__ = ()
+
     def format(self):
         self._format_child(hints=Hint.NO_LB_AFTER)  # <id>
         self._format_child(hints=Hint.NO_LB_AFTER)  # ':'
@@ -793,12 +930,14 @@ class FormalArgFormatter(Formatter):
 
 
 class IndexSliceFormatter(Formatter):
+    __slots__ = ()
+
     def format(self):
         # If any of the limits is a compound node and not a literal, constant,
         # or empty, surround the `:` of the slice with spaces. This mirrors
         # black's style for Python.
         use_space_around_colon = any(
-            map(lambda x: len(x.children) > 1, self.node.children)
+            len(child.children) > 1 for child in self.node.children
         )
 
         self._format_child(hints=Hint.NO_LB_BEFORE)  # '['
@@ -814,17 +953,19 @@ class IndexSliceFormatter(Formatter):
 
 
 class CaptureListFormatter(Formatter):
+    __slots__ = ()
+
     def format(self):
         self._format_child(hints=Hint.NO_LB_BEFORE)  # '['
         while self._get_child_name() == "capture":
             self._format_child()  # <capture>
-            if self._get_child_token() == ",":
-                self._format_child(hints=Hint.NO_LB_BEFORE)  # ','
-                self._write_sp()
+            self._format_comma_sp()
         self._format_child(hints=Hint.NO_LB_BEFORE)  # ']'
 
 
 class StmtFormatter(TypedInitializerFormatter):
+    __slots__ = ()
+
     def _format_stmt_block(self):
         """Helper for formatting a block of statements.
 
@@ -841,9 +982,7 @@ class StmtFormatter(TypedInitializerFormatter):
             self._format_child()  # <capture_list>
             self._write_sp()
         self._format_child(hints=Hint.NO_LB_BEFORE)  # '('
-        self._write_sp()
-        self._format_child()  # <expr>
-        self._write_sp()
+        self._format_child_spaced()  # <expr>
         self._format_child(hints=Hint.NO_LB_BEFORE)  # ')'
         self._format_stmt_block()
 
@@ -855,166 +994,180 @@ class StmtFormatter(TypedInitializerFormatter):
             self._format_curly_statement_list()  # '{' <stmt_list> '}'
             self._write_nl()
 
-    def format(self):
-        # Statements aren't currently broken down into more specific symbol
-        # types in the grammar, so we just examine their beginning.
-        start_name, start_token = self._get_child_name(), self._get_child_token()
+    def _format_block(self):
+        # We don't have to do anything re. Whitesmith here: if this needs
+        # to be indented, the caller has already ensured so via indent=True.
+        self._format_curly_statement_list(indent=False)  # '{' <stmt_list> '}'
 
-        if start_token == "{":
-            # We don't have to do anything re. Whitesmith here: if this needs
-            # to be indented, the caller has already ensured so via indent=True.
-            self._format_curly_statement_list(indent=False)  # '{' <stmt_list> '}'
+    def _format_print_event(self):
+        self._format_child()  # 'print'/'event'
+        self._write_sp()
+        self._format_child_range(2)  # <expr_list>/<event_hdr> ';'
+        self._write_nl()
 
-        elif start_token in ["print", "event"]:
-            self._format_child()  # 'print'/'event'
-            self._write_sp()
-            self._format_child_range(2)  # <expr_list>/<event_hdr> ';'
-            self._write_nl()
+    def _format_if(self):
+        self._format_child()  # 'if'
+        self._write_sp()
+        self._format_child(hints=Hint.NO_LB_BEFORE)  # '('
+        self._format_child_spaced()  # <expr>
+        self._format_child(hints=Hint.NO_LB_BEFORE)  # ')'
 
-        elif start_token == "if":
-            self._format_child()  # 'if'
-            self._write_sp()
-            self._format_child(hints=Hint.NO_LB_BEFORE)  # '('
-            self._write_sp()
-            self._format_child()  # <expr>
-            self._write_sp()
-            self._format_child(hints=Hint.NO_LB_BEFORE)  # ')'
-
-            # Our if-statement layout is either
-            #
-            #   if ( foo )
-            #           bar();
-            #   ...
-            #
-            # or
-            #
-            #   if ( foo )
-            #           {
-            #           bar();
-            #           }
-            #   ...
-            #
-            # We need to establish whether the subsequent statement is a
-            # {}-block: if it's not, we write a newline and need to indent,
-            # because {}-blocks take care of indentation as another statement
-            # type (higher up in this function).
-
-            self._format_stmt_block()
-
-            # An else-block also requires special treatment
-            if self._get_child_token() == "else":
-                self._format_child()  # 'else'
-
-                # Special treatment of "else if": we keep those on the same
-                # line, since otherwise, a switch-case-like cascade of if-else
-                # would get progressively more indented.
-                if self._get_child().has_property(
-                    lambda n: n.nonerr_children[0].token() == "if"
-                ):
-                    self._write_sp()
-                    self._format_child()  # <stmt>
-                else:
-                    self._format_stmt_block()
+        # Our if-statement layout is either
+        #
+        #   if ( foo )
+        #           bar();
+        #   ...
+        #
+        # or
+        #
+        #   if ( foo )
+        #           {
+        #           bar();
+        #           }
+        #   ...
+        #
+        # We need to establish whether the subsequent statement is a
+        # {}-block: if it's not, we write a newline and need to indent,
+        # because {}-blocks take care of indentation as another statement
+        # type (see _format_block()).
 
-        elif start_token == "switch":
-            self._format_child()  # 'switch'
-            self._write_sp()
-            self._format_child()  # <expr>
-            self._write_nl()
-            self._format_child(indent=True)  # '{'
-            # Shorten braces to "{ }" if there is at most whitespace between them.
-            if (
-                self._get_child_token() == "}"
-                and self._get_child().has_only_whitespace_before()
-            ):
+        self._format_stmt_block()
+
+        # An else-block also requires special treatment
+        if self._get_child_token() == "else":
+            self._format_child()  # 'else'
+
+            # Special treatment of "else if": we keep those on the same
+            # line, since otherwise, a switch-case-like cascade of if-else
+            # would get progressively more indented.
+            stmt_children = self._get_child().nonerr_children
+            if stmt_children and stmt_children[0].token() == "if":
                 self._write_sp()
-                self._format_child()  # '}'
+                self._format_child()  # <stmt>
             else:
-                if self._get_child_name() == "case_list":
-                    self._write_nl()
-                    self._format_child(indent=True)  # <case_list>
+                self._format_stmt_block()
+
+    def _format_switch(self):
+        self._format_child()  # 'switch'
+        self._write_sp()
+        self._format_child()  # <expr>
+        self._write_nl()
+        self._format_child(indent=True)  # '{'
+        # Shorten braces to "{ }" if there is at most whitespace between them.
+        if (
+            self._get_child_token() == "}"
+            and self._get_child().has_only_whitespace_before()
+        ):
+            self._write_sp()
+            self._format_child()  # '}'
+        else:
+            if self._get_child_name() == "case_list":
                 self._write_nl()
-                self._format_child(indent=True)  # '}'
+                self._format_child(indent=True)  # <case_list>
             self._write_nl()
+            self._format_child(indent=True)  # '}'
+        self._write_nl()
 
-        elif start_token == "for":
-            self._format_child()  # 'for'
-            self._write_sp()
-            self._format_child(hints=Hint.NO_LB_BEFORE)  # '('
-            self._write_sp()
-            if self._get_child_token() == "[":
-                self._format_child(hints=Hint.NO_LB_BEFORE)  # '['
-                while self._get_child_token() != "]":
-                    self._format_child()  # <id>
-                    if self._get_child_token() == ",":
-                        self._format_child(hints=Hint.NO_LB_BEFORE)  # ','
-                        self._write_sp()
-                self._format_child(hints=Hint.NO_LB_BEFORE)  # ']'
-            else:
+    def _format_for(self):
+        self._format_child()  # 'for'
+        self._write_sp()
+        self._format_child(hints=Hint.NO_LB_BEFORE)  # '('
+        self._write_sp()
+        if self._get_child_token() == "[":
+            self._format_child(hints=Hint.NO_LB_BEFORE)  # '['
+            while self._get_child_token() != "]":
                 self._format_child()  # <id>
+                self._format_comma_sp()
+            self._format_child(hints=Hint.NO_LB_BEFORE)  # ']'
+        else:
+            self._format_child()  # <id>
 
-            while self._get_child_token() == ",":
-                self._format_child(hints=Hint.NO_LB_BEFORE)  # ','
-                self._write_sp()
-                self._format_child()  # <id>
-            self._write_sp()
-            self._format_child()  # 'in'
-            self._write_sp()
-            self._format_child()  # <expr>
-            self._write_sp()
-            self._format_child(hints=Hint.NO_LB_BEFORE)  # ')'
-            self._format_stmt_block()  # <stmt>
+        while self._format_comma_sp():
+            self._format_child()  # <id>
+        self._format_child_spaced()  # 'in'
+        self._format_child()  # <expr>
+        self._write_sp()
+        self._format_child(hints=Hint.NO_LB_BEFORE)  # ')'
+        self._format_stmt_block()  # <stmt>
+
+    def _format_while(self):
+        self._format_child()  # 'while'
+        self._write_sp()
+        self._format_child(hints=Hint.NO_LB_BEFORE)  # '('
+        self._format_child_spaced()  # <expr>
+        self._format_child(hints=Hint.NO_LB_BEFORE)  # ')'
+        self._format_stmt_block()  # <stmt>
 
-        elif start_token == "while":
-            self._format_child()  # 'while'
+    def _format_loop_ctrl(self):
+        self._format_child_range(2)  # loop control statement, ';'
+        self._write_nl()
+
+    def _format_return(self):
+        self._format_child()  # 'return'
+        # There's also an optional 'return" before when statements,
+        # so detour in that case and be done.
+        if self._get_child_token() == "when":
             self._write_sp()
-            self._format_child(hints=Hint.NO_LB_BEFORE)  # '('
+            self._format_when()
+            return
+        if self._get_child_name() == "expr":
             self._write_sp()
             self._format_child()  # <expr>
-            self._write_sp()
-            self._format_child(hints=Hint.NO_LB_BEFORE)  # ')'
-            self._format_stmt_block()  # <stmt>
+        self._format_child(hints=Hint.NO_LB_BEFORE)  # ';'
+        self._write_nl()
 
-        elif start_token in ["next", "break", "fallthrough"]:
-            self._format_child_range(2)  # loop control statement, ';'
-            self._write_nl()
+    def _format_add_delete(self):
+        self._format_child()  # set management
+        self._write_sp()
+        self._format_child_range(2)  # <expr> ';'
+        self._write_nl()
 
-        elif start_token == "return":
-            self._format_child()  # 'return'
-            # There's also an optional 'return" before when statements,
-            # so detour in that case and be done.
-            if self._get_child_token() == "when":
-                self._write_sp()
-                self._format_when()
-                return
-            if self._get_child_name() == "expr":
-                self._write_sp()
-                self._format_child()  # <expr>
-            self._format_child(hints=Hint.NO_LB_BEFORE)  # ';'
-            self._write_nl()
+    def _format_local_const(self):
+        self._format_child()  # 'local'/'const'
+        self._write_sp()
+        self._format_child()  # <id>
+        self._format_typed_initializer()
+        self._format_child(hints=Hint.NO_LB_BEFORE)  # ';'
+        self._write_nl()
 
-        elif start_token in ["add", "delete"]:
-            self._format_child()  # set management
-            self._write_sp()
-            self._format_child_range(2)  # <expr> ';'
-            self._write_nl()
+    def _format_empty(self):
+        self._format_child(hints=Hint.NO_LB_BEFORE)  # ';'
+        self._write_nl()
 
-        elif start_token in ["local", "const"]:
-            self._format_child()  # 'local'/'const'
-            self._write_sp()
-            self._format_child()  # <id>
-            self._format_typed_initializer()
-            self._format_child(hints=Hint.NO_LB_BEFORE)  # ';'
-            self._write_nl()
+    # Handlers for statements identified by their first token.
+    _TOKEN_HANDLERS = {
+        "{": _format_block,
+        "print": _format_print_event,
+        "event": _format_print_event,
+        "if": _format_if,
+        "switch": _format_switch,
+        "for": _format_for,
+        "while": _format_while,
+        "next": _format_loop_ctrl,
+        "break": _format_loop_ctrl,
+        "fallthrough": _format_loop_ctrl,
+        "return": _format_return,
+        "add": _format_add_delete,
+        "delete": _format_add_delete,
+        "local": _format_local_const,
+        "const": _format_local_const,
+        "when": _format_when,
+        ";": _format_empty,
+    }
 
-        elif start_token == "when":
-            self._format_when()
+    def format(self):
+        # Statements aren't currently broken down into more specific symbol
+        # types in the grammar, so we just examine their beginning.
+        start_name, start_token = self._peek()
+
+        handler = self._TOKEN_HANDLERS.get(start_token)
+
+        if handler is not None:
+            handler(self)
 
         elif start_name == "index_slice":
             self._format_child()  # <index_slice>
-            self._write_sp()
-            self._format_child()  # '='
-            self._write_sp()
+            self._format_child_spaced()  # '='
             self._format_child_range(2)  # <expr> ';'
             self._write_nl()
 
@@ -1026,28 +1179,30 @@ class StmtFormatter(TypedInitializerFormatter):
             self._format_child()  # <preproc_directive>
             self._write_nl()
 
-        elif start_token == ";":
-            self._format_child(hints=Hint.NO_LB_BEFORE)  # ';'
-            self._write_nl()
-
 
 class ExprListFormatter(Formatter, ComplexSequenceFormatterMixin):
+    __slots__ = ()
+
     def format(self):
-        if Hint.COMPLEX_BLOCK in self.hints or self.is_complex():
-            while self._get_child_name() == "expr":
-                self._format_child(indent=True)  # <expr>
-                if self._get_child():
-                    self._format_child(hints=Hint.NO_LB_BEFORE)  # ','
-                    self._write_nl()
+        if self.hints & Hint.COMPLEX_BLOCK or self.is_complex():
+            indent, write_sep = True, self._write_nl
         else:
-            while self._get_child_name() == "expr":
-                self._format_child()  # <expr>
-                if self._get_child():
-                    self._format_child(hints=Hint.NO_LB_BEFORE)  # ','
-                    self._write_sp()
+            indent, write_sep = False, self._write_sp
+
+        # The grammar alternates <expr> and ',', so we can step through the
+        # children by position rather than examining each one.
+        num = self._children_remaining()
+
+        for idx in range(0, num, 2):
+            self._format_child(indent=indent)  # <expr>
+            if idx + 1 < num:
+                self._format_child(hints=Hint.NO_LB_BEFORE)  # ','
+                write_sep()
 
 
 class CaseListFormatter(Formatter):
+    __slots__ = ()
+
     def format(self):
         while self._get_child():
             if self._get_child_token() == "case":
@@ -1062,6 +1217,8 @@ class CaseListFormatter(Formatter):
 
 
 class CaseTypeListFormatter(Formatter):
+    __slots__ = ()
+
     def format(self):
         while self._get_child_token() == "type":
             self._format_child()  # 'type'
@@ -1072,12 +1229,12 @@ class CaseTypeListFormatter(Formatter):
                 self._format_child()  # 'as'
                 self._write_sp()
                 self._format_child()  # <id>
-            if self._get_child_token() == ",":
-                self._format_child(hints=Hint.NO_LB_BEFORE)  # ','
-                self._write_sp()
+            self._format_comma_sp()
 
 
 class EventHdrFormatter(Formatter):
+    __slots__ = ()
+
     def format(self):
         self._format_child()  # <id>
         self._format_child(hints=Hint.NO_LB_BEFORE)  # '('
@@ -1091,11 +1248,13 @@ class ExprFormatter(SpaceSeparatedFormatter, ComplexSequenceFormatterMixin):
     # types, so we use helpers or parse into them to identify what particular
     # kind of expression we're facing.
 
+    __slots__ = ("_chains",)  # Outcomes of _is_expr_chain_of(), by predicate.
+
     def _is_binary_boolean(self):
         """Predicate, returns true if this an || or && expression."""
         return len(self.node.nonerr_children) == 3 and self._get_child_token(
             offset=1, absolute=True
-        ) in ("||", "&&")
+        ) in {"||", "&&"}
 
     def _is_string_concat(self):
         """Predicate, returns true if this a <string> + <string> expression."""
@@ -1132,153 +1291,207 @@ class ExprFormatter(SpaceSeparatedFormatter, ComplexSequenceFormatterMixin):
         This helps identify chains of similar expressions, per the above
         predicates.
         """
+        # Every expression along a chain shares the outcome, and parents get
+        # formatted before their children, so we remember the outcome in each
+        # visited formatter. This keeps long chains from becoming quadratic.
+        visited = []
         node = self.node
 
-        while (
-            node
-            and isinstance(node.formatter, ExprFormatter)
-            and formatter_predicate(node.formatter)
-        ):
+        while node and isinstance(node.formatter, ExprFormatter):
+            chains = getattr(node.formatter, "_chains", None)
+            if chains is None:
+                chains = node.formatter._chains = {}
+            elif formatter_predicate in chains:
+                result = chains[formatter_predicate]
+                break
+
+            visited.append(chains)
+
+            if not formatter_predicate(node.formatter):
+                result = False
+                break
+
             node = node.parent
+        else:
+            result = node is not None
 
-        return node and not isinstance(node.formatter, ExprFormatter)
+        for chains in visited:
+            chains[formatter_predicate] = result
 
-    def format(self):
-        cn1, cn2, _ = (self._get_child_name(offset=n) for n in (0, 1, 2))
-        ct1, ct2, ct3 = (self._get_child_token(offset=n) for n in (0, 1, 2))
+        return result
 
-        if cn1 == "expr" and ct2 == "[":
-            self._format_child()  # <expr>
-            self._format_child(hints=Hint.NO_LB_BEFORE | Hint.NO_LB_AFTER)  # '['
-            self._format_child()  # <expr_list>
-            self._format_child(hints=Hint.NO_LB_BEFORE)  # ']'
+    def _format_index(self):
+        self._format_child()  # <expr>
+        self._format_child(hints=Hint.NO_LB_BEFORE | Hint.NO_LB_AFTER)  # '['
+        self._format_child()  # <expr_list>
+        self._format_child(hints=Hint.NO_LB_BEFORE)  # ']'
 
-        elif cn1 == "expr" and ct2 == "$":
+    def _format_field(self):
+        self._format_child()
+        self._format_child(hints=Hint.NO_LB_BEFORE | Hint.NO_LB_AFTER)
+        while self._get_child():
             self._format_child()
-            self._format_child(hints=Hint.NO_LB_BEFORE | Hint.NO_LB_AFTER)
-            while self._get_child():
-                self._format_child()
 
-        elif cn1 == "expr" and cn2 == "index_slice":
-            while self._get_child():
-                self._format_child()
+    def _format_index_slice(self):
+        while self._get_child():
+            self._format_child()
 
-        elif ct1 == "!":
-            # Negation looks better when spaced apart
-            self._format_child(hints=Hint.NO_LB_AFTER)
+    def _format_not_in(self):
+        self._format_child()  # <expr>
+        self._write_sp()
+        self._format_child(hints=Hint.NO_LB_AFTER)  # '!'
+        self._format_child()  # 'in'
+        self._write_sp()
+        self._format_child()  # <expr>
+
+    def _format_has_field(self):
+        self._format_child_range(3)  # <expr> '$?' <expr>
+
+    def _format_call(self):
+        # initializers such as table(...)
+        self._format_child()  # 'table' etc
+        self._format_child(hints=Hint.NO_LB_BEFORE)  # '('
+        if self._get_child_name() == "expr_list":
+            self._format_child()
+        self._format_child(hints=Hint.NO_LB_BEFORE)  # ')'
+        if self._get_child_name() == "attr_list":
             self._write_sp()
             self._format_child()
 
-        elif ct1 in ["|", "++", "--", "~", "-", "+"]:
-            # No space when those operators are involved
-            self._format_child(hints=Hint.NO_LB_AFTER)
-            while self._get_child():
-                self._format_child()
+    def _format_negation(self):
+        # Negation looks better when spaced apart
+        self._format_child(hints=Hint.NO_LB_AFTER)
+        self._write_sp()
+        self._format_child()
 
-        elif cn1 == "expr" and ct2 == "!" and ct3 == "in":
-            self._format_child()  # <expr>
-            self._write_sp()
-            self._format_child(hints=Hint.NO_LB_AFTER)  # '!'
-            self._format_child()  # 'in'
-            self._write_sp()
-            self._format_child()  # <expr>
+    def _format_unary(self):
+        # No space when those operators are involved
+        self._format_child(hints=Hint.NO_LB_AFTER)
+        while self._get_child():
+            self._format_child()
 
-        elif ct1 in ("{", "["):
-            # Vector/table/set initializers: '['/'{' <expr_list> ']'/'}'
-            do_linebreak = self.is_complex()  # Must call before we consume opener
-            self._format_child(hints=Hint.NO_LB_BEFORE)  # '{' / '['
-            if self._get_child_name() == "expr_list":
-                if do_linebreak:
-                    self._write_nl()
-                    self._format_child(hints=Hint.COMPLEX_BLOCK)  # expr_list
-                    self._write_nl()
-                else:
-                    self._write_sp()
-                    self._format_child()  # expr_list
-                    self._write_sp()
+    def _format_initializer(self):
+        # Vector/table/set initializers: '['/'{' <expr_list> ']'/'}'
+        do_linebreak = self.is_complex()  # Must call before we consume opener
+        self._format_child(hints=Hint.NO_LB_BEFORE)  # '{' / '['
+        if self._get_child_name() == "expr_list":
+            if do_linebreak:
+                self._write_nl()
+                self._format_child(hints=Hint.COMPLEX_BLOCK)  # expr_list
+                self._write_nl()
             else:
-                # Just a space when the initializer list has no members.
                 self._write_sp()
+                self._format_child()  # expr_list
+                self._write_sp()
+        else:
+            # Just a space when the initializer list has no members.
+            self._write_sp()
 
-            self._format_child()  # '}' / ']'
+        self._format_child()  # '}' / ']'
 
-        elif ct1 == "(":
-            self._format_child(hints=Hint.NO_LB_BEFORE)  # '('
-            self._write_sp()
-            self._format_child(hints=Hint.NO_LB_AFTER)  # <expr>
-            self._write_sp()
-            self._format_child()  # ')'
+    def _format_paren(self):
+        self._format_child(hints=Hint.NO_LB_BEFORE)  # '('
+        self._format_child_spaced(hints=Hint.NO_LB_AFTER)  # <expr>
+        self._format_child()  # ')'
 
-        elif ct1 == "$" and ct3 == "=":
+    def _format_dollar(self):
+        if self._get_child_token(2) == "=":
             self._format_child_range(4)  # '$'<id> = <expr>
+            return
 
-        elif ct1 == "$":  # The function version, with possible capture
-            self._format_child_range(2)  # '$'<id>
-            self._write_sp()
-            self._format_child(
-                hints=Hint.NO_LB_BEFORE | Hint.NO_LB_AFTER
-            )  # <begin_lambda>
-            self._write_sp()
-            self._format_child(hints=Hint.NO_LB_BEFORE)  # '='
-            self._write_sp()
-            self._format_child()  # <func_body>
+        # The function version, with possible capture
+        self._format_child_range(2)  # '$'<id>
+        self._format_child_spaced(
+            hints=Hint.NO_LB_BEFORE | Hint.NO_LB_AFTER
+        )  # <begin_lambda>
+        self._format_child(hints=Hint.NO_LB_BEFORE)  # '='
+        self._write_sp()
+        self._format_child()  # <func_body>
 
-        elif ct1 == "copy":
-            self._format_child()  # 'copy'
-            self._format_child(hints=Hint.NO_LB_BEFORE)  # '('
-            self._format_child_range(2)  # <expr> ')'
+    def _format_copy(self):
+        self._format_child()  # 'copy'
+        self._format_child(hints=Hint.NO_LB_BEFORE)  # '('
+        self._format_child_range(2)  # <expr> ')'
 
-        elif ct2 == "?$":
-            self._format_child_range(3)  # <expr> '$?' <expr>
+    def _format_lambda(self):
+        self._format_child_range(2)  # 'function' <begin_lambda>
+        self._write_sp()
+        self._format_child()  # <func_body>
 
-        elif ct1 == "function":
-            self._format_child_range(2)  # 'function' <begin_lambda>
-            self._write_sp()
-            self._format_child()  # <func_body>
-
-        elif ct2 == "(":
-            # initializers such as table(...)
-            self._format_child()  # 'table' etc
-            self._format_child(hints=Hint.NO_LB_BEFORE)  # '('
-            if self._get_child_name() == "expr_list":
-                self._format_child()
-            self._format_child(hints=Hint.NO_LB_BEFORE)  # ')'
-            if self._get_child_name() == "attr_list":
-                self._write_sp()
-                self._format_child()
+    def _format_boolean(self):
+        # For Boolean AND/OR, check if this is a toplevel sequence of them,
+        # and if so, recommend the operator for linebreaks. ("toplevel"
+        # means that this must be AND/OR and all parent expressions must be,
+        # up to something that isn't an expression -- a statement, for
+        # example.)
+        #
+        # We do this so we can line-break complex boolean expressions so
+        # that each toplevel one ends on a new line, starting with the
+        # boolean operand. OutputStream's handling of the GOOD_AFTER_LB
+        # hint implements this.
+        hints = None
+
+        if self._is_expr_chain_of(ExprFormatter._is_binary_boolean):
+            # Okay! It's AND/ORs all the way up to something not an expr.
+            hints = Hint.GOOD_AFTER_LB
 
-        elif self._is_binary_boolean():
-            # For Boolean AND/OR, check if this is a toplevel sequence of them,
-            # and if so, recommend the operator for linebreaks. ("toplevel"
-            # means that this must be AND/OR and all parent expressions must be,
-            # up to something that isn't an expression -- a statement, for
-            # example.)
-            #
-            # We do this so we can line-break complex boolean expressions so
-            # that each toplevel one ends on a new line, starting with the
-            # boolean operand. OutputStream's handling of the GOOD_AFTER_LB
-            # hint implements this.
-            hints = None
-
-            if self._is_expr_chain_of(ExprFormatter._is_binary_boolean):
-                # Okay! It's AND/ORs all the way up to something not an expr.
-                hints = Hint.GOOD_AFTER_LB
+        self._format_child()  # <expr>
+        self._format_child_spaced(hints=hints)  # '&&' / '||'
+        self._format_child()  # <expr>
 
-            self._format_child()  # <expr>
-            self._write_sp()
-            self._format_child(hints=hints)  # '&&' / '||'
-            self._write_sp()
-            self._format_child()  # <expr>
+    def _format_string_concat(self):
+        # This helps OutputStream nicely align long strings broken into
+        # substrings concatenated by "+".
+        self._format_child()  # <expr>
+        self._format_child_spaced(hints=Hint.GOOD_AFTER_LB)  # '+'
+        self._format_child()  # <expr>
 
-        elif self._is_string_concat():
-            # This helps OutputStream nicely align long strings broken into
-            # substrings concatenated by "+".
-            self._format_child()  # <expr>
-            self._write_sp()
-            self._format_child(hints=Hint.GOOD_AFTER_LB)  # '+'
-            self._write_sp()
-            self._format_child()  # <expr>
+    # Handlers for expressions that begin with a token, identified by it.
+    _TOKEN_HANDLERS = {
+        "!": _format_negation,
+        "|": _format_unary,
+        "++": _format_unary,
+        "--": _format_unary,
+        "~": _format_unary,
+        "-": _format_unary,
+        "+": _format_unary,
+        "{": _format_initializer,
+        "[": _format_initializer,
+        "(": _format_paren,
+        "$": _format_dollar,
+        "copy": _format_copy,
+        "function": _format_lambda,
+    }
+
+    # Handlers for expressions that begin with an <expr>, identified by the
+    # name or token of the child following it. A '!' after an expression
+    # only occurs in "!in".
+    _EXPR_HANDLERS = {
+        "[": _format_index,
+        "$": _format_field,
+        "index_slice": _format_index_slice,
+        "!": _format_not_in,
+        "?$": _format_has_field,
+        "(": _format_call,
+    }
+
+    def format(self):
+        cn1, ct1 = self._peek()
+        cn2, ct2 = self._peek(1)
 
+        if cn1 == "expr":
+            handler = self._EXPR_HANDLERS.get(cn2 or ct2)
+        else:
+            handler = self._TOKEN_HANDLERS.get(ct1)
+            if handler is None and ct2 == "(":
+                handler = ExprFormatter._format_call
+
+        if handler is not None:
+            handler(self)
+        elif self._is_binary_boolean():
+            self._format_boolean()
+        elif self._is_string_concat():
+            self._format_string_concat()
         else:
             # Fall back to simple space-separation
             super().format()
@@ -1293,32 +1506,43 @@ class NlFormatter(Formatter):
     line.
     """
 
-    def format(self):
-        node = self.node
-        # If this has another newline after it, do nothing.
-        if node.next_cst_sibling and node.next_cst_sibling.is_nl():
-            return
+    __slots__ = ()
 
+    def format(self):
         # Write a single newline for any sequence of blank lines in the input,
-        # unless this sequence is at the beginning or end of the sequence.
+        # unless this sequence is at the beginning or end of the sequence. The
+        # last newline of the sequence takes care of this.
+        #
+        # Most newlines in a script just end a line, so check first whether
+        # this one is alone, which is the cheapest test that lets us bail.
+        # (This is prev.is_nl(), inlined: no token has type "nl".)
+        prev = self.node.prev_cst_sibling
+        if prev is None or prev.type != "nl":
+            # It's a lone newline, or the first of a sequence.
+            return
 
-        if not node.next_cst_sibling or node.next_cst_sibling.token() == "}":
-            # It's at the end of a NL sequence.
+        # If this has another newline after it, do nothing.
+        nxt = self.node.next_cst_sibling
+        if nxt is None or nxt.is_nl() or nxt.token() == "}":
             return
 
-        if node.prev_cst_sibling and node.prev_cst_sibling.is_nl():
-            # It's a NL sequence.
-            while node.prev_cst_sibling and node.prev_cst_sibling.is_nl():
-                node = node.prev_cst_sibling
+        # It's the end of a NL sequence. Find what precedes it.
+        while prev is not None and prev.is_nl():
+            prev = prev.prev_cst_sibling
 
-            if node.prev_cst_sibling and node.prev_cst_sibling.token() != "{":
-                # There's something other than whitspace before this sequence.
-                self._write_nl(force=True)
+        if prev is not None and prev.token() != "{":
+            # There's something other than whitspace before this sequence.
+            self._write_nl(force=True)
 
 
 class AttrFormatter(Formatter):
+    __slots__ = ()
+
     def format(self):
-        if self._get_child_token(offset=1) == "=":
+        # Attributes are either just a token ("&redef") or an assignment
+        # ("&default=<expr>"). They're plentiful, so check the shape directly.
+        children = self.node.nonerr_children
+        if len(children) == 3 and children[1].type == "=":
             # The range ensures we keep this on one line
             self._format_child_range(3)
         else:
@@ -1328,30 +1552,33 @@ class AttrFormatter(Formatter):
 class CommentFormatter(Formatter):
     """Base class for any kind of comment."""
 
+    __slots__ = ()
+
     def __init__(self, script, node, ostream, indent=0, hints=None):
-        super().__init__(script, node, ostream, indent, hints)
+        Formatter.__init__(self, script, node, ostream, indent, hints)
         self.hints |= Hint.ZERO_WIDTH  # Comments never count toward line length
 
 
 class MinorCommentFormatter(CommentFormatter):
+    __slots__ = ()
+
     def format(self):
-        node = self.node
-        # There's something before us and it's not a newline, then
-        # separate this comment from it with a space:
-        if node.prev_cst_sibling and not node.prev_cst_sibling.is_nl():
+        # If there's nothing or a newline before us, then this comment spans the
+        # whole line. Otherwise, separate it with a space from what precedes it
+        # and mark the newline we write afterward as mid-line.
+        prev = self.node.prev_cst_sibling
+        is_midline = prev is not None and not prev.is_nl()
+
+        if is_midline:
             self._write_sp()
 
         self._format_token()  # Write comment itself
-
-        # If there's nothing or a newline before us, then this comment spans the
-        # whole line and we write a regular newline.
-        if node.prev_cst_sibling is None or node.prev_cst_sibling.is_nl():
-            self._write_nl()
-        else:
-            self._write_nl(is_midline=True)
+        self._write_nl(is_midline=is_midline)
 
 
 class ZeekygenCommentFormatter(CommentFormatter):
+    __slots__ = ()
+
     def format(self):
         self._format_token()
         self._write_nl()
@@ -1360,8 +1587,10 @@ class ZeekygenCommentFormatter(CommentFormatter):
 class ZeekygenPrevCommentFormatter(CommentFormatter):
     """A formatter for Zeekygen comments that refer to earlier items (##<)."""
 
+    __slots__ = ("column",)
+
     def __init__(self, script, node, ostream, indent=0, hints=None):
-        super().__init__(script, node, ostream, indent, hints)
+        CommentFormatter.__init__(self, script, node, ostream, indent, hints)
         self.column = 0  # Start column of this comment.
 
     def format(self):
@@ -1372,8 +1601,11 @@ class ZeekygenPrevCommentFormatter(CommentFormatter):
 
         # If, newlines aside, another ##< comment came before us, space-align us
         # to the same start column of that comment.
-        pnode = self.node.find_prev_cst_sibling(lambda n: not n.is_nl())
-        if pnode and pnode.is_zeekygen_prev_comment():
+        pnode = self.node.prev_cst_sibling
+        while pnode is not None and pnode.is_nl():
+            pnode = pnode.prev_cst_sibling
+
+        if pnode is not None and pnode.is_zeekygen_prev_comment():
             self._write_sp(pnode.formatter.column - self.ostream.get_column())
         else:
             self._write_sp()
@@ -1386,36 +1618,38 @@ class ZeekygenPrevCommentFormatter(CommentFormatter):
         self._format_token()
 
         # If this has another ##< comment after it, write the newline.
-        try:
-            if (
-                self.node.next_cst_sibling.is_nl()
-                and self.node.next_cst_sibling.next_cst_sibling.is_zeekygen_prev_comment()
-            ):
+        nxt = self.node.next_cst_sibling
+        if nxt is not None and nxt.is_nl():
+            nxt = nxt.next_cst_sibling
+            if nxt is not None and nxt.is_zeekygen_prev_comment():
                 self._write_nl()
-        except AttributeError:
-            pass
 
 
 # ---- Explicit mappings for grammar symbols to formatters ---------------------
 #
-# NodeMapper.get() retrieves formatters not listed here by mapping symbol
-# names to class names, e.g. module_decl -> ModuleDeclFormatter.
-
-Formatter.register("const_decl", GlobalDeclFormatter)
-Formatter.register("global_decl", GlobalDeclFormatter)
-Formatter.register("option_decl", GlobalDeclFormatter)
-Formatter.register("redef_decl", GlobalDeclFormatter)
-
-Formatter.register("func", FuncHdrVariantFormatter)
-Formatter.register("hook", FuncHdrVariantFormatter)
-Formatter.register("event", FuncHdrVariantFormatter)
-
-Formatter.register("capture", SpaceSeparatedFormatter)
-Formatter.register("attr_list", SpaceSeparatedFormatter)
-Formatter.register("interval", SpaceSeparatedFormatter)
-Formatter.register("enum_body_elem", SpaceSeparatedFormatter)
-
-Formatter.register("zeekygen_head_comment", ZeekygenCommentFormatter)
-Formatter.register("zeekygen_next_comment", ZeekygenCommentFormatter)
-
-Formatter.register("nullnode", NullFormatter)
+# Symbols not listed here map to the formatter class with the corresponding
+# name, per the NodeMapper.register_classes() call at the end.
+
+MAP.register_all(
+    {
+        "const_decl": GlobalDeclFormatter,
+        "global_decl": GlobalDeclFormatter,
+        "option_decl": GlobalDeclFormatter,
+        "redef_decl": GlobalDeclFormatter,
+        "func": FuncHdrVariantFormatter,
+        "hook": FuncHdrVariantFormatter,
+        "event": FuncHdrVariantFormatter,
+        "capture": SpaceSeparatedFormatter,
+        "attr_list": SpaceSeparatedFormatter,
+        "interval": SpaceSeparatedFormatter,
+        "enum_body_elem": SpaceSeparatedFormatter,
+        "zeekygen_head_comment": ZeekygenCommentFormatter,
+        "zeekygen_next_comment": ZeekygenCommentFormatter,
+        "nullnode": NullFormatter,
+        # Tree-Sitter's error nodes don't follow the grammar's naming.
+        "ERROR": ErrorFormatter,
+    }
+)
+
+# Everything else maps by class name, e.g. module_decl -> ModuleDeclFormatter.
+MAP.register_classes(globals())
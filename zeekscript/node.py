@@ -245,7 +245,7 @@ class Node:
         they are all whitespace. The scan stops when it hits an AST node, which
         counts as success. Absence of preceding CST nodes is also success.
         """
-        res = self.find_prev_cst_sibling(lambda node: not node.is_nl())
+        res = self.find_prev_cst_sibling(_is_not_nl)
         return res is None or res.is_ast
 
     def has_only_whitespace_after(self):
@@ -255,7 +255,7 @@ class Node:
         they are all whitespace. The scan stops when it hits an AST node, which
         counts as success. Absence of suceeding CST nodes is also success.
         """
-        node = self.find_next_cst_sibling(lambda node: not node.is_nl())
+        node = self.find_next_cst_sibling(_is_not_nl)
         return node is None or node.is_ast
 
     def find_prev_cst_sibling(self, predicate):
@@ -291,3 +291,8 @@ class Node:
                 return node
             node = node.next_cst_sibling
         return None
+
+
+def _is_not_nl(node):
+    """Sibling-search predicate matching anything other than newlines."""
+    return not node.is_nl()
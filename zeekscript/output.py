@@ -4,6 +4,17 @@ import sys
 
 from .formatter import Formatter, Hint
 
+# Tab indentations up to a reasonable nesting depth, so we don't need to build
+# these anew for every line.
+_TABS = tuple(b"\t" * num for num in range(33))
+
+# The whitespace that space-aligns continued lines.
+_SPACE_ALIGN = b" " * 4
+
+
+def _tabs(num):
+    return _TABS[num] if num < len(_TABS) else b"\t" * num
+
 
 # pylint: disable-next=too-few-public-methods
 class Output:
@@ -13,9 +24,14 @@ class Output:
     formatted line, deciding when/whether to intersperse additional line breaks.
     """
 
+    # There's one of these per written chunk, so keep them lean.
+    __slots__ = ("data", "formatter", "is_blank")
+
     def __init__(self, data, formatter):
         self.data = data
         self.formatter = formatter
+        # Whether the data is pure whitespace. Line wrapping asks repeatedly.
+        self.is_blank = not data.strip()
 
 
 class OutputStream:
@@ -30,13 +46,29 @@ class OutputStream:
     MIN_LINE_EXCESS = 5  # Minimum characters that a line needs to be too long.
     TAB_SIZE = 8  # How many visible characters we chalk up for a tab.
     SPACE_INDENT = 4  # When wrapping, add this many spaces onto tab-indentation.
+    WRITE_BUFSIZE = 1 << 16  # Bytes of finished lines to collect per ostream write.
 
     def __init__(self, ostream, enable_linebreaks=True):
         """OutputStream constructor. The ostream argument is a file-like object."""
+        if ostream is sys.stdout and hasattr(ostream, "buffer"):
+            # Write bytes straight to stdout's binary buffer, instead of
+            # decoding them for the text layer. Flush that layer first so
+            # anything already printed keeps its place.
+            ostream.flush()
+            ostream = ostream.buffer
         self._ostream = ostream
         self._col = 0  # 0-based column the next character goes into.
+
+        # Whether we're at the beginning of a line, i.e. self._col == 0.
+        # Formatters check this on every write, so it's a plain attribute.
+        self.at_bol = True
+
         self._tab_indent = 0  # Number of tabs indented in current line
 
+        # Whitespace starting a wrapped line, by tab-indentation. Filled in as
+        # needed by self._wrap_indent().
+        self._wrap_indents = {}
+
         # Series of Output objects that makes up a formatted but un-wrapped line.
         self._linebuffer = []
 
@@ -45,6 +77,12 @@ class OutputStream:
         # self._write().
         self._writebuffer = []
 
+        # Finished lines not yet written to the ostream, and their total size.
+        # We write these out once they reach WRITE_BUFSIZE bytes, since ostream
+        # writes can be costly.
+        self._outbuffer = []
+        self._outbuffer_len = 0
+
         # Whether we'll consider linebreaks at all. When False, long lines will
         # never wrap. When True, linebreaks will generally happen, but
         # formatters may pause them temporarily via the _use_linebreaks flag
@@ -57,8 +95,9 @@ class OutputStream:
         # Whether to tuck on space-alignments independently of our own linebreak
         # logic. (Some formatters request this.) These alignments don't
         # currently align properly to a particular character in the previous
-        # line; they just add a few spaces.
-        self._use_space_align = False
+        # line; they just add a few spaces. Formatters update this with every
+        # newline they write, so it's a plain attribute, like at_bol.
+        self.space_align = False
 
     def __enter__(self):
         return self
@@ -74,7 +113,7 @@ class OutputStream:
         self._use_tab_indent = enable
 
     def use_space_align(self, enable):
-        self._use_space_align = enable
+        self.space_align = enable
 
     def write(self, data, formatter, raw=False):
         if raw:
@@ -82,11 +121,21 @@ class OutputStream:
             self._write(data)
             # Sync column count as per last line content in raw data:
             self._col = len(data.split(Formatter.NL)[-1])
+            self.at_bol = self._col == 0
             return
 
         # For troubleshooting received hinting
         # print_error('XXX "%s" %s' % (data, formatter.hints))
 
+        # Most writes are single tokens or whitespace without any line breaks.
+        # These simply extend the current line.
+        if b"\n" not in data and b"\r" not in data:
+            if data:
+                self._col += len(data)
+                self._linebuffer.append(Output(data, formatter))
+                self.at_bol = False
+            return
+
         # In case the data spans multiple lines, break up the lines now.
         # Potential line-wrapping is applied when we flush individual lines.
         for chunk in data.splitlines(keepends=True):
@@ -95,18 +144,53 @@ class OutputStream:
             if chunk.endswith(Formatter.NL):
                 self._flush_line()
 
+        self.at_bol = self._col == 0
+
+    def write_indent(self, formatter):
+        """Writes any tab-indentation and space-alignment in effect.
+
+        This is the combination of write_tab_indent() and write_space_align(),
+        producing a single chunk of whitespace at the beginning of a line.
+        """
+        indent = b""
+        if self._use_tab_indent:
+            self._tab_indent = formatter.indent
+            indent = _tabs(self._tab_indent)
+        if self.space_align:
+            indent += _SPACE_ALIGN
+        if indent:
+            self._append(indent, formatter)
+
     def write_tab_indent(self, formatter):
         if self._use_tab_indent:
             self._tab_indent = formatter.indent
-            self.write(b"\t" * self._tab_indent, formatter)
+            self.write(_tabs(self._tab_indent), formatter)
 
     def write_space_align(self, formatter):
-        if self._use_space_align:
-            self.write(b" " * 4, formatter)
+        if self.space_align:
+            self._append(_SPACE_ALIGN, formatter)
 
     def get_column(self):
         return self._col
 
+    def _append(self, data, formatter):
+        """Adds data without any line breaks to the current line.
+
+        This is write() minus the line splitting, for whitespace we know
+        doesn't need it.
+        """
+        self._col += len(data)
+        self._linebuffer.append(Output(data, formatter))
+        self.at_bol = False
+
+    def _wrap_indent(self, num):
+        """Returns the tabs and spaces that begin a wrapped line."""
+        indent = self._wrap_indents.get(num)
+        if indent is None:
+            indent = _tabs(num) + b" " * self.SPACE_INDENT
+            self._wrap_indents[num] = indent
+        return indent
+
     def _flush_line(self):
         """Flushes out the line buffer, stripping trailing whitespace.
 
@@ -120,11 +204,11 @@ class OutputStream:
 
         # Without linebreaking active, just flush the buffer.
         if not self._enable_linebreaks or not self._use_linebreaks:
-            for out in self._linebuffer:
-                self._write(out.data)
-
+            if self._linebuffer:
+                self._write(b"".join(out.data for out in self._linebuffer))
             self._linebuffer = []
             self._col = 0
+            self.at_bol = True
             return
 
         col_flushed = 0  # Column up to which we've currently written a line
@@ -133,54 +217,44 @@ class OutputStream:
         line_items = 0  # Number of items (tokens, not whitespace) on formatted line
         using_break_hints = False  # Whether we've used advisory linebreak hints yet
 
-        def flush_tbd():
-            nonlocal tbd, tbd_len, col_flushed
-            for tbd_out in tbd:
-                self._write(tbd_out.data)
-                col_flushed += len(tbd_out.data)
-            tbd = []
-            tbd_len = 0
-
-        def write_linebreak():
-            nonlocal tbd, tbd_len, col_flushed
-            self._write(Formatter.NL)
-            self._write(b"\t" * self._tab_indent)
-            self._write(b" " * self.SPACE_INDENT)
-            col_flushed = self._tab_indent * self.TAB_SIZE + self.SPACE_INDENT
-
-            # Remove any pure whitespace from the beginning of the
-            # continuation of the line we just broke:
-            while tbd and not tbd[0].data.strip():
-                tbd_len -= len(tbd.pop(0).data)
-
-        # Count number of non-whitespace items on the line. This helps with some
-        # linebreak heuristics below.
-        for out in self._linebuffer:
-            if out.data.strip():
-                line_items += 1
-
         # It is logistically more difficult to honor NO_LB_BEFORE as it arises,
         # because we need to "look-ahead" to prevent breaking. To simplify,
         # reverse-iterate over the line's tokens and tuck NO_LB_AFTER onto
-        # tokens that precede NO_LB_BEFORE.
+        # tokens that precede NO_LB_BEFORE. In the same pass, count the number
+        # of non-whitespace items on the line. This helps with some linebreak
+        # heuristics below.
         needs_no_lb_after = False
-        for out in self._linebuffer[::-1]:
-            if out.data.strip() and needs_no_lb_after:
-                out.formatter.hints |= Hint.NO_LB_AFTER
-                needs_no_lb_after = False
-            if Hint.NO_LB_BEFORE in out.formatter.hints:
+        for out in reversed(self._linebuffer):
+            if not out.is_blank:
+                line_items += 1
+                if needs_no_lb_after:
+                    out.formatter.hints |= Hint.NO_LB_AFTER
+                    needs_no_lb_after = False
+            if out.formatter.hints & Hint.NO_LB_BEFORE:
                 needs_no_lb_after = True
 
+        # Every linebreak condition below requires the line to exceed
+        # MAX_LINE_LEN, so a line that fits goes out in one piece. (We still
+        # need the above pass, since formatters keep the propagated hints.)
+        if self._col <= self.MAX_LINE_LEN:
+            if self._linebuffer:
+                self._write(b"".join(out.data for out in self._linebuffer))
+            self._linebuffer = []
+            self._col = 0
+            self.at_bol = True
+            return
+
         # Now do the actual line processing.
         for out in self._linebuffer:
             tbd.append(out)
+            hints = out.formatter.hints
 
             # Establish how long the pending chunk is, given hinting:
-            if Hint.ZERO_WIDTH not in out.formatter.hints:
+            if not hints & Hint.ZERO_WIDTH:
                 tbd_len += len(out.data)
 
             # Don't make line-wrapping decisions based on whitespace:
-            if not out.data.strip():
+            if out.is_blank:
                 continue
 
             # We name the various conditions going into the linebreak decision,
@@ -191,12 +265,11 @@ class OutputStream:
             # conditionals. This needs to take precedence over NO_LB_AFTER,
             # see next condition.
             cnd_good_after_lb = (
-                Hint.GOOD_AFTER_LB in out.formatter.hints
-                and self._col > self.MAX_LINE_LEN
+                bool(hints & Hint.GOOD_AFTER_LB) and self._col > self.MAX_LINE_LEN
             )
 
             # If the caller requested no line break, abide.
-            cnd_no_lb_after = Hint.NO_LB_AFTER in out.formatter.hints
+            cnd_no_lb_after = bool(hints & Hint.NO_LB_AFTER)
 
             # Similarly, if we git GOOD_AFTER_LB earlier, abide.
             cnd_no_break_hints = not using_break_hints
@@ -236,7 +309,7 @@ class OutputStream:
             # break, then break now. This helps align e.g. multi-part boolean
             # conditionals. This needs to take precedence over NO_LB_AFTER.
             if cnd_good_after_lb:
-                write_linebreak()
+                linebreak = True
                 using_break_hints = True
 
             # Honor hinted linebreak suppression around this chunk.
@@ -244,26 +317,44 @@ class OutputStream:
                 continue
 
             # Finally actually linebreak as needed:
-            elif (
-                cnd_no_break_hints
-                and cnd_line_too_long
-                and cnd_enough_excess
-                and cnd_enough_line_items
-                and cnd_no_addl_wrap
-            ):
-                write_linebreak()
-
-            flush_tbd()
+            else:
+                linebreak = (
+                    cnd_no_break_hints
+                    and cnd_line_too_long
+                    and cnd_enough_excess
+                    and cnd_enough_line_items
+                    and cnd_no_addl_wrap
+                )
+
+            if linebreak:
+                self._write(Formatter.NL)
+                self._write(self._wrap_indent(self._tab_indent))
+                col_flushed = self._tab_indent * self.TAB_SIZE + self.SPACE_INDENT
+
+                # Remove any pure whitespace from the beginning of the
+                # continuation of the line we just broke:
+                while tbd and tbd[0].is_blank:
+                    tbd_len -= len(tbd.pop(0).data)
+
+            # Flush the pending chunks.
+            for tbd_out in tbd:
+                self._write(tbd_out.data)
+                col_flushed += len(tbd_out.data)
+            tbd = []
+            tbd_len = 0
 
-        # Another flush to finish any leftovers
-        flush_tbd()
+        # Write out any leftovers
+        for tbd_out in tbd:
+            self._write(tbd_out.data)
 
         self._linebuffer = []
         self._col = 0
+        self.at_bol = True
 
     def _flush_writes(self):
         if self._writebuffer and not self._writebuffer[-1].endswith(Formatter.NL):
             self._write(Formatter.NL)
+        self._write_out()
 
     def _write(self, data):
         self._writebuffer.append(data)
@@ -274,14 +365,31 @@ class OutputStream:
         if not data.endswith(Formatter.NL):
             return
 
+        # Most lines have no trailing whitespace, so only strip when the
+        # character before the newline says so.
         output = b"".join(self._writebuffer)
-        output = output.rstrip() + Formatter.NL
+        if output[-len(Formatter.NL) - 1 : -len(Formatter.NL)].isspace():
+            output = output.rstrip() + Formatter.NL
+        self._outbuffer.append(output)
+        self._outbuffer_len += len(output)
         self._writebuffer = []
 
+        if self._outbuffer_len >= self.WRITE_BUFSIZE:
+            self._write_out()
+
+    def _write_out(self):
+        """Writes any finished lines to the ostream."""
+        if not self._outbuffer:
+            return
+
+        output = b"".join(self._outbuffer)
+        self._outbuffer = []
+        self._outbuffer_len = 0
+
         try:
-            if self._ostream == sys.stdout:
-                # Clunky: must write string here, not bytes. We could
-                # use _ostream.buffer -- not sure how portable that is.
+            if self._ostream is sys.stdout:
+                # A replaced stdout without a binary buffer, such as a
+                # StringIO, must be written strings.
                 self._ostream.write(output.decode("UTF-8"))
             else:
                 self._ostream.write(output)
@@ -174,6 +174,12 @@ class Script:
         The output destination can be one of three things: a filename, a file
         object, or None, which means stdout. enable_linebreaks, True by default,
         controls whether to use linebreaks at all.
+
+        Formatting recurses through the parse tree at a few stack frames per
+        nesting level. At Python's default recursion limit of 1000 this
+        handles roughly 250 levels, e.g. a chain of 250 string
+        concatenations. Deeper scripts raise RecursionError unless the
+        caller raises the limit via sys.setrecursionlimit().
         """
         assert self.root is not None, "call Script.parse() before Script.format()"
 
@@ -298,7 +304,10 @@ class Script:
             new_node.is_named = node.is_named
             new_node.is_missing = node.is_missing
             new_node.has_error = node.has_error
-            new_node.type = node.type
+            # Interning the type string lets the formatters' many comparisons
+            # and dict lookups on it hit identity fast paths, and shares one
+            # string across all nodes of a given type.
+            new_node.type = sys.intern(node.type)
 
             # Mark the node as AST-only if it's not a newline or comment. Those
             # are extras (in TS terminology) that occur anywhere in the tree.
@@ -306,19 +315,17 @@ class Script:
             if node.type != "nl" and not node.type.endswith("_comment"):
                 new_node.is_ast = True
 
-            new_children = []
-
-            # Set up state for all of the node's children. This recurses
-            # so we build up our own tree.
-            for child in node.children:
-                new_child = make_node(child)
+            return new_node
 
+        def link_children(new_node, new_children):
+            # Set up state for all of the node's children, whose own subtrees
+            # are complete at this point.
+            for idx, new_child in enumerate(new_children):
                 # Fully link CST nodes so they can reason about their neighbors
-                if new_children:
-                    new_children[-1].next_cst_sibling = new_child
-                    new_child.prev_cst_sibling = new_children[-1]
+                if idx > 0:
+                    new_children[idx - 1].next_cst_sibling = new_child
+                    new_child.prev_cst_sibling = new_children[idx - 1]
 
-                new_children.append(new_child)
                 new_child.parent = new_node
 
                 # Only register AST nodes directly in the child list. This
@@ -435,9 +442,23 @@ class Script:
             if pending_errors:
                 new_node.nonerr_children[-1].next_error_siblings = pending_errors
 
-            return new_node
-
+        # Clone the tree with an explicit stack rather than by recursion, so
+        # deeply nested scripts don't exhaust Python's recursion limit. A node's
+        # children get linked only once their own subtrees are complete, so we
+        # do this in the reverse of the order in which we created the nodes.
         self.root = make_node(self.ts_tree.root_node)
+        stack = [(self.ts_tree.root_node, self.root)]
+        cloned = []
+
+        while stack:
+            node, new_node = stack.pop()
+            children = node.children
+            new_children = [make_node(child) for child in children]
+            cloned.append((new_node, new_children))
+            stack.extend(zip(children, new_children))
+
+        for new_node, new_children in reversed(cloned):
+            link_children(new_node, new_children)
 
     def _patch_tree(self):
         """Tweak the syntax tree to simplify formatting."""